@@ -3,45 +3,117 @@
 # --------------------------------------------------------------
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
-import json, os, tempfile, threading, time, random, re
-from midiutil import MIDIFile
-import matplotlib.pyplot as plt
-from matplotlib.patches import Ellipse, Rectangle
+import io, json, threading, time, random, re
+from collections import deque
+from contextlib import contextmanager
+import numpy as np
+from matplotlib.collections import EllipseCollection, LineCollection
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+from PIL import Image, ImageTk
 
 # -------------------  NOTE HELPERS  -------------------
 NOTE_MAP = {'C':0,'D':2,'E':4,'F':5,'G':7,'A':9,'B':11}
 ACC_MAP  = {'#':1, 'B':-1, 'b':-1}
 DRUM_MAP = {'K':35, 'S':38, 'H':42}  # Kick, Snare, Hi-hat
 
-def midi_from_str(note_str, c_scale):
-    if note_str.upper() == 'R': return None
-    if note_str[0].upper() in DRUM_MAP: return DRUM_MAP[note_str[0].upper()]
-    letter = note_str[0].upper()
-    mod = note_str[1:].lower()
-    base = NOTE_MAP[letter]
-    if mod and mod[0] in ACC_MAP: base += ACC_MAP[mod[0]]
-    base = base % 12
-    return c_scale + base
-
-def staff_pos(letter, c_scale):
-    if letter in DRUM_MAP: return 6  # middle line for drums
-    octave = c_scale // 12
-    return NOTE_MAP[letter.upper()] + (octave - 4) * 7
-
-def accidental_sym(note_str):
-    if len(note_str)>1 and note_str[1] in '#Bb':
-        return '#' if note_str[1]=='#' else 'b'
-    return ''
+# staff positions as tables: letter → index → base step, and whether the octave shift applies (drums sit on line 6)
+_LETTER_IDX = {l: i for i, l in enumerate('CDEFGAB' + ''.join(DRUM_MAP))}
+_LETTER_STEP = np.array([NOTE_MAP[l] for l in 'CDEFGAB'] + [6]*len(DRUM_MAP), dtype=np.int16)
+_LETTER_OCTAVED = np.array([1]*7 + [0]*len(DRUM_MAP), dtype=np.int16)
+
+def staff_pos_array(letter_idx, c_scales):
+    """Staff positions for parallel arrays of _LETTER_IDX values and C-scales."""
+    return _LETTER_STEP[letter_idx] + _LETTER_OCTAVED[letter_idx] * (c_scales // 12 - 4) * 7
+
+# pitch class per letter index; drum letters hold their absolute GM note
+_LETTER_PC = np.array([NOTE_MAP[l] for l in 'CDEFGAB'] + list(DRUM_MAP.values()), dtype=np.int16)
+_ACC_SYM = {1: '#', -1: 'b'}
+
+def _parse_riff(notes):
+    """Parse a riff's note groups into flat per-sub-note arrays (SoA).
+
+    Group i owns subs sub_offsets[i]:sub_offsets[i+1] (rests own none); letters are
+    _LETTER_IDX values, accs are -1/0/+1 and drums flags K/S/H hits.
+    """
+    is_rest = np.zeros(len(notes), dtype=np.int8)
+    offsets, letters, accs, drums = [0], [], [], []
+    for i, ng in enumerate(notes):
+        if ng.upper()=='R':
+            is_rest[i] = 1
+        else:
+            for s in ng.split('+'):
+                let = s[0].upper()
+                letters.append(_LETTER_IDX[let])
+                accs.append(ACC_MAP.get(s[1:2], 0))
+                drums.append(let in DRUM_MAP)
+        offsets.append(len(letters))
+    return {'src': notes,
+            'letters': np.array(letters, dtype=np.int8), 'accs': np.array(accs, dtype=np.int8),
+            'drums': np.array(drums, dtype=np.int8), 'is_rest': is_rest,
+            'sub_offsets': np.array(offsets, dtype=np.int32)}
+
+def riff_parsed(riff):
+    """riff['_parsed'], re-parsed whenever riff['notes'] has been replaced."""
+    parsed = riff.get('_parsed')
+    if parsed is None or parsed['src'] is not riff['notes']:
+        parsed = riff['_parsed'] = _parse_riff(riff['notes'])
+    return parsed
+
+def riff_layout(riff, c_scale, x0, x_adv):
+    """Positions for one riff: (parsed, group x, subs per group, sub x, sub y, end x)."""
+    p = riff_parsed(riff)
+    n = len(p['is_rest'])
+    gx = x0 + x_adv*np.arange(n)
+    counts = np.diff(p['sub_offsets'])
+    return p, gx, counts, np.repeat(gx, counts), staff_pos_array(p['letters'], c_scale), x0 + x_adv*n
+
+def chord_extents(gx, counts, ys):
+    """(x, min y, max y) of every group with more than one sub-note."""
+    full = counts > 0
+    if not full.any(): return gx[:0], ys[:0], ys[:0]
+    starts = (np.cumsum(counts) - counts)[full]
+    lo, hi = np.minimum.reduceat(ys, starts), np.maximum.reduceat(ys, starts)
+    chord = counts[full] > 1
+    return gx[full][chord], lo[chord], hi[chord]
+
+def riff_pitches(p, c_scale):
+    """MIDI note of every sub-note in a parsed riff."""
+    pc = _LETTER_PC[p['letters']]
+    return np.where(p['drums'], pc, c_scale + (pc + p['accs']) % 12)
+
+# one row per emitted note; see CardWriterApp._collect_events
+# time/dur stay f8: midiutil truncates beats to ticks, so float32 rounding would move notes by a tick
+MIDI_EVENT_DTYPE = np.dtype([('t','u1'),('c','u1'),('p','u1'),('time','f8'),('dur','f8'),('vel','u1')])
 
 def get_duration(val):
     d = {'1s':4,'2':2,'4s':1,'8s':.5,'16s':.25,'32s':.125}
     return d.get(val,1)
 
+_PROG_RE = re.compile(r'\((\d+)\)')
+
 def extract_program(combo_text):
-    m = re.search(r'\((\d+)\)', combo_text)
+    m = _PROG_RE.search(combo_text)
     return int(m.group(1)) if m else 0
 
+def draw_staff_background(ax, time_sig=True):
+    """Five staff lines, treble clef and, optionally, the 4/4 time signature."""
+    for y in range(2,11,2): ax.axhline(y, color='k', lw=1)
+    ax.text(0.2,7,'G',fontsize=40,va='center')
+    if time_sig:
+        ax.text(1.2,9,'4',fontsize=20,ha='center'); ax.text(1.2,5,'4',fontsize=20,ha='center')
+
+def add_note_collections(ax, centers, facecolors, stem_segs, head_size, stem_lw, **kw):
+    """All note heads as one EllipseCollection and all stems as one LineCollection."""
+    heads = EllipseCollection(head_size[0], head_size[1], 0, units='xy',
+                              offsets=np.asarray(centers, dtype=float).reshape(-1,2),
+                              offset_transform=ax.transData,
+                              facecolors=facecolors, edgecolors='k', **kw)
+    stems = LineCollection(stem_segs, colors='k', linewidths=stem_lw, **kw)
+    ax.add_collection(heads, autolim=False); ax.add_collection(stems, autolim=False)
+    return heads, stems
+
 # -------------------  CHORD & GROKIFY  -------------------
 CHORD_LIB = {
     "C":  ["C","E","G"],     "Cm": ["C","Eb","G"],
@@ -52,21 +124,23 @@ CHORD_LIB = {
     "F":  ["F","A","C"],     "Fm": ["F","Ab","C"]
 }
 
+_CHORD_VALUES = list(CHORD_LIB.values())
+_CHORD_STRS = ['+'.join(v) for v in _CHORD_VALUES]
+# rest 15%, chord 30% of the rest, single note otherwise
+_CATS = ('R','C','N')
+_CAT_WEIGHTS = (0.15, 0.255, 0.595)
+
+def _grok_note():
+    letter = random.choice('CDEFGAB')
+    if random.random() < 0.3:
+        letter += random.choice(['#','b'])
+    return letter
+
+_GROK_PICK = {'R': lambda: 'R', 'C': lambda: random.choice(_CHORD_STRS), 'N': _grok_note}
+
 def grokify_riff():
-    notes = []
     length = random.randint(4, 8)
-    for _ in range(length):
-        if random.random() < 0.15:
-            notes.append('R')
-        elif random.random() < 0.3:
-            chord = random.choice(list(CHORD_LIB.values()))
-            notes.append('+'.join(chord))
-        else:
-            letter = random.choice('CDEFGAB')
-            if random.random() < 0.3:
-                letter += random.choice(['#','b'])
-            notes.append(letter)
-    return ' '.join(notes)
+    return ' '.join(_GROK_PICK[cat]() for cat in random.choices(_CATS, _CAT_WEIGHTS, k=length))
 
 # -------------------  P2P EDITOR  -------------------
 class P2PStaffEditor(tk.Toplevel):
@@ -76,7 +150,7 @@ class P2PStaffEditor(tk.Toplevel):
         self.title("P2P Edit")
         self.geometry("800x300")
         self.notes = card.riff['notes'].copy()
-        self.fig, self.ax = plt.subplots(figsize=(10,3))
+        self.fig = Figure(figsize=(10,3)); self.ax = self.fig.add_subplot(111)
         self.canvas = FigureCanvasTkAgg(self.fig, master=self)
         self.canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
         self.canvas.mpl_connect('button_press_event', self.on_click)
@@ -86,29 +160,13 @@ class P2PStaffEditor(tk.Toplevel):
 
     def draw_staff(self):
         ax = self.ax; ax.clear()
-        for y in range(2,11,2): ax.axhline(y, color='k', lw=1)
-        ax.text(0.2,7,'G',fontsize=40,va='center')
-        x = 1.0
-        for ng in self.notes:
-            if ng.upper()=='R':
-                ax.text(x,6,'rest',fontsize=12,ha='center')
-                x += 1.2; continue
-            subs = ng.split('+')
-            ys = []
-            for s in subs:
-                let = s[0].upper()
-                y = staff_pos(let, self.card.riff['c_scale'])
-                ys.append(y)
-                acc = accidental_sym(s)
-                if acc: ax.text(x-0.3, y, acc, fontsize=12, ha='center')
-            for y in ys:
-                ax.add_patch(Ellipse((x,y),0.7,0.5,facecolor='k',edgecolor='k'))
-            if len(subs)>1:
-                ax.vlines(x+0.35, min(ys), max(ys)+2.5, color='k', lw=1.5)
-            x += 1.2
+        draw_staff_background(ax, time_sig=False)
+        app = self.card.app
+        scope = (app.tracks[self.card.track], {**self.card.riff, 'notes': self.notes})
+        app._render_score(ax, card_scope=scope, x0=1.0, x_step=1.2)
         for gx in range(1,30): ax.axvline(gx, ymin=0.1, ymax=0.9, color='gray', lw=0.5, alpha=0.3)
         ax.set_xlim(0,30); ax.set_ylim(0,12); ax.axis('off')
-        self.canvas.draw()
+        self.canvas.draw_idle()
 
     def on_click(self, event):
         if not event.inaxes: return
@@ -129,13 +187,79 @@ class P2PStaffEditor(tk.Toplevel):
 
     def done(self):
         self.card.riff['notes'] = self.notes
+        riff_parsed(self.card.riff)
         self.card.entry.delete(0,tk.END)
         self.card.entry.insert(0,' '.join(self.notes))
         self.card.draw_staff()
         self.card.app.update_full_sheet()
         self.destroy()
 
+# -------------------  CARD STAFF RENDERER  -------------------
+class CardStaffRenderer:
+    """One offscreen Agg figure shared by every RiffCard; each render is copied out as a PhotoImage."""
+    def __init__(self):
+        self.fig = Figure(figsize=(3.2,1.2))
+        self.canvas = FigureCanvasAgg(self.fig)
+        self.ax = self.fig.add_subplot(111)
+        self._acc_texts, self._sym_texts = [], []
+        self._draw_static_staff()
+
+    def _draw_static_staff(self):
+        ax = self.ax
+        for y in range(2,11,2): ax.axhline(y, color='k', lw=1)
+        ax.text(0.1,7,'G',fontsize=20,va='center')
+        self._empty_text = ax.text(1.5,6,"empty",ha='center',fontsize=10)
+        self._heads, self._stems = add_note_collections(ax, [], [], [], (0.35,0.25), 1)
+        ax.set_xlim(0,3.5); ax.set_ylim(0,12); ax.axis('off')
+
+    def _take(self, pool_name, make):
+        # next free artist of a pool; only grows when the riff outgrows it
+        pool = getattr(self, pool_name); i = self._used[pool_name]
+        if i == len(pool): pool.append(make())
+        self._used[pool_name] = i + 1
+        a = pool[i]; a.set_visible(True)
+        return a
+
+    def render(self, riff, is_drum, empty=False):
+        ax = self.ax
+        self._used = dict.fromkeys(('_acc_texts','_sym_texts'), 0)
+        new_text = lambda: ax.text(0,0,'',ha='center')
+        centers, fills, stem_segs = [], [], []
+        self._empty_text.set_visible(empty)
+        if not empty and riff['notes']:
+            dur = get_duration(riff['duration'])
+            p, gx, counts, sub_x, ys, _ = riff_layout(riff, riff['c_scale'], 0.8, dur*0.6)
+            for x in gx[p['is_rest'] == 1].tolist():
+                t = self._take('_sym_texts', new_text)
+                t.set_position((x,6)); t.set_text('rest'); t.set_fontsize(9); t.set_va('baseline')
+            if is_drum:
+                for x, let in zip(sub_x.tolist(), p['letters'].tolist()):
+                    t = self._take('_sym_texts', new_text)
+                    t.set_position((x,6)); t.set_text('X' if let==_LETTER_IDX['S'] else 'o')
+                    t.set_fontsize(14); t.set_va('center')
+            else:
+                for x, y, acc in zip(sub_x.tolist(), ys.tolist(), p['accs'].tolist()):
+                    if acc:
+                        t = self._take('_acc_texts', lambda: ax.text(0,0,'',fontsize=9,ha='center'))
+                        t.set_position((x-0.2, y)); t.set_text(_ACC_SYM[acc])
+                centers = np.column_stack((sub_x, ys))
+                fills = 'k' if dur<=1 else 'w'
+                if dur<4:
+                    cx, lo, hi = chord_extents(gx, counts, ys)
+                    stem_segs = [[(x+0.15, a), (x+0.15, b+1.5)] for x, a, b in zip(cx.tolist(), lo.tolist(), hi.tolist())]
+        for pool_name, n in self._used.items():
+            for a in getattr(self, pool_name)[n:]: a.set_visible(False)
+        self._heads.set_offsets(np.asarray(centers, dtype=float).reshape(-1,2))
+        self._heads.set_facecolor(fills)
+        self._stems.set_segments(stem_segs)
+        self.canvas.draw()
+        w, h = self.canvas.get_width_height()
+        img = Image.frombuffer('RGBA', (w,h), self.canvas.buffer_rgba(), 'raw', 'RGBA', 0, 1)
+        return ImageTk.PhotoImage(img)
+
 # -------------------  CARD CLASS  -------------------
+HISTORY_LEN = 64  # undo depth per card
+SAVE_DEBOUNCE_MS = 50
 class RiffCard(tk.Frame):
     def __init__(self, master, track, card_idx, app):
         super().__init__(master, relief=tk.RAISED, bd=2, bg="#f8f8f8")
@@ -143,18 +267,19 @@ class RiffCard(tk.Frame):
         self.track = track
         self.idx = card_idx
         self.riff = {'notes':[], 'duration':'4s', 'c_scale':60, 'strum':False}
-        self.history = []
-        self.redo_stack = []
+        self.history = deque(maxlen=HISTORY_LEN)
+        self.redo_stack = deque(maxlen=HISTORY_LEN)
+        self._save_job = None
 
-        # Staff
-        self.fig, self.ax = plt.subplots(figsize=(3.2,1.2))
-        self.canvas = FigureCanvasTkAgg(self.fig, master=self)
-        self.canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+        # Staff (rendered by the app's shared CardStaffRenderer)
+        self.staff = tk.Label(self, bg="#f8f8f8")
+        self.staff.pack(fill=tk.BOTH, expand=True)
+        self._photo = None
 
         # Controls
         ctrl = tk.Frame(self); ctrl.pack(fill=tk.X, pady=2)
         self.entry = tk.Entry(ctrl, width=25); self.entry.pack(side=tk.LEFT, padx=2)
-        self.entry.bind('<Return>', lambda e: self.save_riff())
+        self.entry.bind('<Return>', lambda e: self._schedule_save())
 
         self.strum_var = tk.BooleanVar()
         tk.Checkbutton(ctrl, text="Strum", variable=self.strum_var).pack(side=tk.LEFT)
@@ -166,83 +291,59 @@ class RiffCard(tk.Frame):
 
         self.draw_staff(empty=True)
 
+    # history entries are (notes, duration, c_scale, strum, entry text) tuples
     def save_state(self):
-        state = self.riff.copy()
-        state['text'] = self.entry.get()
-        state['strum'] = self.strum_var.get()
+        r = self.riff
+        state = (tuple(r['notes']), r['duration'], r['c_scale'], self.strum_var.get(), self.entry.get())
+        if self.history and self.history[-1] == state: return
         self.history.append(state)
         self.redo_stack.clear()
 
+    def _restore_state(self, state):
+        notes, duration, c_scale, strum, text = state
+        self.riff.update(notes=list(notes), duration=duration, c_scale=c_scale, strum=strum)
+        self.entry.delete(0,tk.END)
+        self.entry.insert(0, text)
+        self.strum_var.set(strum)
+        self.draw_staff()
+        self.app.update_full_sheet()
+
     def undo(self):
         if len(self.history) > 1:
             self.redo_stack.append(self.history.pop())
-            prev = self.history[-1]
-            self.riff.update(prev)
-            self.entry.delete(0,tk.END)
-            self.entry.insert(0, prev['text'])
-            self.strum_var.set(prev['strum'])
-            self.draw_staff()
-            self.app.update_full_sheet()
+            self._restore_state(self.history[-1])
 
     def redo(self):
         if self.redo_stack:
             state = self.redo_stack.pop()
             self.history.append(state)
-            self.riff.update(state)
-            self.entry.delete(0,tk.END)
-            self.entry.insert(0, state['text'])
-            self.strum_var.set(state['strum'])
-            self.draw_staff()
-            self.app.update_full_sheet()
+            self._restore_state(state)
 
     def p2p_edit(self):
         self.save_state()
         P2PStaffEditor(self, self)
 
     def grokify(self):
-        self.save_state()
         riff = grokify_riff()
         self.entry.delete(0,tk.END)
         self.entry.insert(0, riff)
         self.save_riff()
 
     def draw_staff(self, empty=False):
-        ax = self.ax; ax.clear()
-        for y in range(2,11,2): ax.axhline(y, color='k', lw=1)
-        ax.text(0.1,7,'G',fontsize=20,va='center')
-        if empty:
-            ax.text(1.5,6,"empty",ha='center',fontsize=10)
-        else:
-            x = 0.8
-            dur = get_duration(self.riff['duration'])
-            is_drum = self.app.tracks[self.track].inst_combo.get().startswith('Acoustic Bass Drum')
-            for ng in self.riff['notes']:
-                if ng.upper()=='R':
-                    ax.text(x,6,'rest',fontsize=9,ha='center')
-                    x += dur*0.6; continue
-                subs = ng.split('+')
-                if is_drum:
-                    for s in subs:
-                        sym = 'X' if s[0].upper()=='S' else 'o'
-                        ax.text(x,6,sym,fontsize=14,ha='center',va='center')
-                    x += dur*0.6; continue
-                ys,accs = [],[]
-                for s in subs:
-                    let = s[0].upper()
-                    y = staff_pos(let, self.riff['c_scale'])
-                    ys.append(y); accs.append(accidental_sym(s))
-                for i,acc in enumerate(accs):
-                    if acc: ax.text(x-0.2, ys[i], acc, fontsize=9, ha='center')
-                fill = dur<=1
-                for y in ys:
-                    ax.add_patch(Ellipse((x,y),0.35,0.25,
-                                        facecolor='k' if fill else 'w',
-                                        edgecolor='k'))
-                if dur<4 and len(subs)>1:
-                    ax.vlines(x+0.15, min(ys), max(ys)+1.5, color='k', lw=1)
-                x += dur*0.6
-        ax.set_xlim(0,3.5); ax.set_ylim(0,12); ax.axis('off')
-        self.canvas.draw()
+        if self.app._batching:
+            self.app._dirty_cards[self] = empty; return
+        is_drum = not empty and self.app.tracks[self.track]._is_drum
+        self._photo = self.app._card_renderer.render(self.riff, is_drum, empty)
+        self.staff.configure(image=self._photo)
+
+    def _schedule_save(self):
+        # coalesce bursts of <Return> into one save/redraw
+        if self._save_job: self.after_cancel(self._save_job)
+        self._save_job = self.after(SAVE_DEBOUNCE_MS, self._run_scheduled_save)
+
+    def _run_scheduled_save(self):
+        self._save_job = None
+        self.save_riff()
 
     def save_riff(self):
         self.save_state()
@@ -252,6 +353,7 @@ class RiffCard(tk.Frame):
         self.riff['notes'] = notes
         self.riff['duration'] = '4s'
         self.riff['strum'] = self.strum_var.get()
+        riff_parsed(self.riff)
         self.app.song_data[self.track][self.idx] = self.riff.copy()
         self.draw_staff()
         self.app.update_full_sheet()
@@ -276,28 +378,39 @@ class TrackRow(tk.Frame):
                     state="readonly")
         self.inst_combo.current(track_idx % 5)
         self.inst_combo.pack(fill=tk.X, pady=2)
-        self.inst_combo.bind('<<ComboboxSelected>>', lambda e: app.update_full_sheet())
+        self._refresh_prog()
+        self.inst_combo.bind('<<ComboboxSelected>>', self._refresh_prog)
+        self.inst_combo.bind('<<ComboboxSelected>>', lambda e: app.update_full_sheet(), add='+')
 
         tk.Label(inst_frame, text="C-Scale:", anchor='w').pack(fill=tk.X)
         c_options = [f"C{i} ({12*i})" for i in range(1,9)]
         self.c_combo = ttk.Combobox(inst_frame, values=c_options, state="readonly", width=10)
         self.c_combo.current(3)
         self.c_combo.pack(fill=tk.X, pady=2)
+        self._refresh_c_scale()
         self.c_combo.bind('<<ComboboxSelected>>', self.update_c_scale)
 
         self.card_frame = tk.Frame(self); self.card_frame.pack(side=tk.LEFT, expand=True, fill=tk.X)
+        self.cards = []
         for i in range(3):
             card = RiffCard(self.card_frame, track_idx, i, app)
             card.pack(side=tk.LEFT, padx=3, fill=tk.BOTH, expand=True)
+            self.cards.append(card)
             app.song_data[track_idx][i] = card.riff
 
+    # combobox values only change on selection (or open_song), so parse them once here
+    def _refresh_prog(self, event=None):
+        self._prog = extract_program(self.inst_combo.get())
+        self._is_drum = self._prog == 35
+
+    def _refresh_c_scale(self, event=None):
+        self._c_scale = int(self.c_combo.get().split('(')[1][:-1])
+
     def update_c_scale(self, event=None):
-        c_text = self.c_combo.get()
-        c_midi = int(c_text.split('(')[1][:-1])
-        for card in self.card_frame.winfo_children():
-            if isinstance(card, RiffCard):
-                card.riff['c_scale'] = c_midi
-                card.draw_staff()
+        self._refresh_c_scale()
+        for card in self.cards:
+            card.riff['c_scale'] = self._c_scale
+            card.draw_staff()
 
 # -------------------  MAIN APP  -------------------
 class CardWriterApp:
@@ -306,6 +419,11 @@ class CardWriterApp:
         self.root.title("GrokMIDI Pro")
         self.song_data = [[{'notes':[], 'duration':'4s', 'c_scale':60, 'strum':False} for _ in range(3)] for _ in range(4)]
         self.current_card = None
+        self._batching = False
+        self._dirty_cards = {}
+        self._mixer_ready = False
+        self._card_renderer = CardStaffRenderer()
+        self._export_canvas = None  # PDF figure, built on first export
 
         # Menu
         menubar = tk.Menu(root)
@@ -339,9 +457,14 @@ class CardWriterApp:
         tk.Button(acts, text="Export MIDI", command=self.export_midi).pack(side=tk.LEFT, padx=3)
         tk.Button(acts, text="Export PDF", command=self.export_pdf).pack(side=tk.LEFT, padx=3)
 
-        self.sheet_fig, self.sheet_ax = plt.subplots(figsize=(12,5))
+        self.sheet_fig = Figure(figsize=(12,5)); self.sheet_ax = self.sheet_fig.add_subplot(111)
         self.sheet_canvas = FigureCanvasTkAgg(self.sheet_fig, master=root)
         self.sheet_canvas.get_tk_widget().pack(pady=10, fill=tk.BOTH, expand=True)
+        self.sheet_bg = None
+        self.sheet_artists = []
+        self.draw_sheet_background()
+        self.sheet_canvas.mpl_connect('draw_event', self._on_sheet_draw)
+        self.sheet_canvas.get_tk_widget().bind('<Configure>', self._invalidate_sheet_bg, add='+')
         self.update_full_sheet()
 
     def add_track(self, idx):
@@ -360,175 +483,185 @@ class CardWriterApp:
     def redo(self):
         if self.current_card: self.current_card.redo()
 
-    def update_full_sheet(self):
+    @contextmanager
+    def _batch_redraw(self):
+        """Hold card/sheet redraws inside the block; draw each dirty card and the sheet once on exit."""
+        self._batching = True
+        try:
+            yield
+        finally:
+            self._batching = False
+            dirty, self._dirty_cards = self._dirty_cards, {}
+            for card, empty in dirty.items(): card.draw_staff(empty=empty)
+            self.update_full_sheet()
+
+    # ---------- FULL SHEET (blitted) ----------
+    def draw_sheet_background(self):
         ax = self.sheet_ax; ax.clear()
-        for y in range(2,11,2): ax.axhline(y, color='k', lw=1)
-        ax.text(0.2,7,'G',fontsize=40,va='center')
-        ax.text(1.2,9,'4',fontsize=20,ha='center'); ax.text(1.2,5,'4',fontsize=20,ha='center')
-        x = 2.0
-        for track in self.tracks:
-            prog = extract_program(track.inst_combo.get())
-            c_scale = int(track.c_combo.get().split('(')[1][:-1])
-            is_drum = prog == 35
-            for card in track.card_frame.winfo_children():
-                if not isinstance(card, RiffCard): continue
-                riff = card.riff
+        draw_staff_background(ax)
+        ax.set_xlim(0,15); ax.set_ylim(0,12); ax.axis('off')
+        self.sheet_bg = None
+
+    def _invalidate_sheet_bg(self, event=None):
+        # resize → the TkAgg canvas schedules a full draw; don't blit a stale-size background before it
+        self.sheet_bg = None
+
+    def _on_sheet_draw(self, event):
+        # every full draw skips animated artists: grab the bare staff, then paint the notes on top
+        self.sheet_bg = self.sheet_canvas.copy_from_bbox(self.sheet_ax.bbox)
+        for a in self.sheet_artists: self.sheet_ax.draw_artist(a)
+
+    def _render_score(self, ax, *, card_scope=None, x0=2.0, x_step=0.8, head_size=(0.7,0.5),
+                      stem_offset=0.35, animated=False):
+        """Draw notes onto ax; returns (artists, end x).
+
+        card_scope=None renders every track's cards back to back; a (track, riff) pair renders
+        just that riff at its own C-scale (the P2P editor's working copy).
+        """
+        if card_scope is None:
+            scope = [(t._c_scale, t._is_drum, [c.riff for c in t.cards]) for t in self.tracks]
+        else:
+            track, riff = card_scope
+            scope = [(riff['c_scale'], track._is_drum, [riff])]
+        art, centers, stem_segs = [], [], []
+        x = x0
+        for c_scale, is_drum, riffs in scope:
+            for riff in riffs:
                 if not riff['notes']: continue
                 dur = get_duration(riff['duration'])
-                for ng in riff['notes']:
-                    if ng.upper()=='R':
-                        ax.text(x,6,'rest',fontsize=12,ha='center')
-                        x += dur*0.8; continue
-                    if is_drum:
-                        for s in ng.split('+'):
-                            sym = 'X' if s[0].upper()=='S' else 'o'
-                            ax.text(x,6,sym,fontsize=14,ha='center',va='center')
-                        x += dur*0.8; continue
-                    subs = ng.split('+')
-                    ys = [staff_pos(s[0].upper(), c_scale) for s in subs]
-                    for i, s in enumerate(subs):
-                        acc = accidental_sym(s)
-                        if acc: ax.text(x-0.3, ys[i], acc, fontsize=12, ha='center')
-                        ax.add_patch(Ellipse((x,ys[i]),0.7,0.5, facecolor='k', edgecolor='k'))
-                    if dur<4 and len(subs)>1:
-                        ax.vlines(x+0.35, min(ys), max(ys)+2.5, color='k', lw=1.5)
-                    x += dur*0.8
+                p, gx, counts, sub_x, ys, x = riff_layout(riff, c_scale, x, dur*x_step)
+                for rx in gx[p['is_rest'] == 1].tolist():
+                    art.append(ax.text(rx,6,'rest',fontsize=12,ha='center',animated=animated))
+                if is_drum:
+                    for sx, let in zip(sub_x.tolist(), p['letters'].tolist()):
+                        sym = 'X' if let==_LETTER_IDX['S'] else 'o'
+                        art.append(ax.text(sx,6,sym,fontsize=14,ha='center',va='center',animated=animated))
+                    continue
+                for sx, y, acc in zip(sub_x.tolist(), ys.tolist(), p['accs'].tolist()):
+                    if acc: art.append(ax.text(sx-0.3, y, _ACC_SYM[acc], fontsize=12, ha='center', animated=animated))
+                centers.append(np.column_stack((sub_x, ys)))
+                if dur<4:
+                    cx, lo, hi = chord_extents(gx, counts, ys)
+                    stem_segs.extend([(sx+stem_offset, a), (sx+stem_offset, b+2.5)]
+                                     for sx, a, b in zip(cx.tolist(), lo.tolist(), hi.tolist()))
             x += 1.5
-        ax.set_xlim(0, max(x+2,15)); ax.set_ylim(0,12); ax.axis('off')
-        self.sheet_canvas.draw()
+        centers = np.concatenate(centers) if centers else np.empty((0,2))
+        art.extend(add_note_collections(ax, centers, 'k', stem_segs, head_size, 1.5, animated=animated))
+        return art, x
+
+    def update_full_sheet(self):
+        if self._batching: return
+        ax = self.sheet_ax
+        for a in self.sheet_artists: a.remove()
+        self.sheet_artists, x = self._render_score(ax, animated=True)
+        xlim = (0, max(x+2,15))
+        if self.sheet_bg is None or ax.get_xlim() != xlim:
+            # clef/time-sig live in data coords, so a new x range means a new background
+            ax.set_xlim(*xlim)
+            self.sheet_bg = None  # stale until the idle draw recaptures it; later updates must not blit it
+            self.sheet_canvas.draw_idle()
+            return
+        self.sheet_canvas.restore_region(self.sheet_bg)
+        for a in self.sheet_artists: ax.draw_artist(a)
+        self.sheet_canvas.blit(ax.bbox)
 
     # ---------- MIDI ----------
     def preview_midi(self):
         threading.Thread(target=self._play_midi, daemon=True).start()
 
+    def _collect_events(self):
+        """Every note of the song as one structured array (track, channel, pitch, time, dur, vel)."""
+        chunks = []
+        for t_idx, track in enumerate(self.tracks):
+            chan = 9 if track._prog==35 else 0
+            c_scale = track._c_scale
+            time_pos = 0
+            for card in track.cards:
+                riff = card.riff
+                if not riff['notes']: continue
+                dur = get_duration(riff['duration'])
+                delay = 0.03 if riff.get('strum', False) else 0
+                p = riff_parsed(riff)
+                counts = np.diff(p['sub_offsets'])
+                starts = time_pos + dur*np.arange(len(counts))
+                # strum offset = position of the sub-note inside its group
+                within = np.arange(counts.sum()) - np.repeat(p['sub_offsets'][:-1], counts)
+                ev = np.empty(len(within), dtype=MIDI_EVENT_DTYPE)
+                ev['t'], ev['c'], ev['vel'], ev['dur'] = t_idx, chan, 100, dur
+                ev['p'] = riff_pitches(p, c_scale)
+                ev['time'] = np.repeat(starts, counts) + delay*within
+                chunks.append(ev)
+                time_pos += dur*len(counts)
+        return np.concatenate(chunks) if chunks else np.empty(0, dtype=MIDI_EVENT_DTYPE)
+
+    def _build_midi(self):
+        from midiutil import MIDIFile
+        midi = MIDIFile(len(self.tracks))
+        global_bpm = int(self.global_bpm.get() or 120)
+        for t_idx, track in enumerate(self.tracks):
+            midi.addTrackName(t_idx, 0, track.inst_combo.get().split(' (')[0])
+            midi.addTempo(t_idx, 0, global_bpm)
+            midi.addProgramChange(t_idx, 0, 0, track._prog)
+        for t, c, p, when, dur, vel in self._collect_events().tolist():
+            midi.addNote(t, c, p, when, dur, vel)
+        return midi
+
+    def _init_mixer(self):
+        import pygame
+        if not self._mixer_ready:
+            pygame.mixer.init()
+            self._mixer_ready = True
+        return pygame
+
     def _play_midi(self):
         try:
-            tf = tempfile.NamedTemporaryFile(suffix='.mid', delete=False)
-            midi = MIDIFile(len(self.tracks))
-            global_bpm = int(self.global_bpm.get() or 120)
-            for t_idx, track in enumerate(self.tracks):
-                prog = extract_program(track.inst_combo.get())
-                midi.addTrackName(t_idx, 0, track.inst_combo.get().split(' (')[0])
-                midi.addTempo(t_idx, 0, global_bpm)
-                midi.addProgramChange(t_idx, 0, 0, prog)
-                c_scale = int(track.c_combo.get().split('(')[1][:-1])
-                time_pos = 0
-                for card in track.card_frame.winfo_children():
-                    if not isinstance(card, RiffCard): continue
-                    riff = card.riff
-                    if not riff['notes']: continue
-                    dur = get_duration(riff['duration'])
-                    strum = riff.get('strum', False)
-                    delay = 0.03 if strum else 0
-                    for ng in riff['notes']:
-                        if ng.upper()=='R':
-                            time_pos += dur; continue
-                        subs = ng.split('+')
-                        pitches = [midi_from_str(s, c_scale) for s in subs]
-                        for j, p in enumerate(pitches):
-                            if p is None: continue
-                            offset = delay * j
-                            midi.addNote(t_idx, 9 if prog==35 else 0, p, time_pos + offset, dur, 100)
-                        time_pos += dur
-            midi.writeFile(tf); tf.close()
-            import pygame
-            pygame.mixer.init()
-            pygame.mixer.music.load(tf.name)
+            buf = io.BytesIO()
+            self._build_midi().writeFile(buf); buf.seek(0)
+            pygame = self._init_mixer()
+            pygame.mixer.music.load(buf, 'mid')
             pygame.mixer.music.play()
             while pygame.mixer.music.get_busy(): time.sleep(0.1)
-            os.unlink(tf.name)
         except Exception as e:
             messagebox.showerror("Error", str(e))
 
     def stop_midi(self):
+        if not self._mixer_ready: return
         import pygame
         pygame.mixer.music.stop()
 
     def export_midi(self):
         path = filedialog.asksaveasfilename(defaultextension=".mid")
         if not path: return
-        midi = MIDIFile(len(self.tracks))
-        global_bpm = int(self.global_bpm.get() or 120)
-        for t_idx, track in enumerate(self.tracks):
-            prog = extract_program(track.inst_combo.get())
-            midi.addTrackName(t_idx, 0, track.inst_combo.get().split(' (')[0])
-            midi.addTempo(t_idx, 0, global_bpm)
-            midi.addProgramChange(t_idx, 0, 0, prog)
-            c_scale = int(track.c_combo.get().split('(')[1][:-1])
-            time_pos = 0
-            for card in track.card_frame.winfo_children():
-                if not isinstance(card, RiffCard): continue
-                riff = card.riff
-                if not riff['notes']: continue
-                dur = get_duration(riff['duration'])
-                strum = riff.get('strum', False)
-                delay = 0.03 if strum else 0
-                for ng in riff['notes']:
-                    if ng.upper()=='R':
-                        time_pos += dur; continue
-                    subs = ng.split('+')
-                    pitches = [midi_from_str(s, c_scale) for s in subs]
-                    for j, p in enumerate(pitches):
-                        if p is None: continue
-                        offset = delay * j
-                        midi.addNote(t_idx, 9 if prog==35 else 0, p, time_pos + offset, dur, 100)
-                    time_pos += dur
+        midi = self._build_midi()
         with open(path, 'wb') as f: midi.writeFile(f)
         messagebox.showinfo("Saved", f"MIDI → {path}")
 
     def export_pdf(self):
         path = filedialog.asksaveasfilename(defaultextension=".pdf")
         if not path: return
-        fig, ax = plt.subplots(figsize=(12,6))
-        for y in range(2,11,2): ax.axhline(y, color='k', lw=1)
-        ax.text(0.2,7,'G',fontsize=40,va='center')
-        ax.text(1.2,9,'4',fontsize=20,ha='center'); ax.text(1.2,5,'4',fontsize=20,ha='center')
-        x = 2.0
-        for track in self.tracks:
-            c_scale = int(track.c_combo.get().split('(')[1][:-1])
-            prog = extract_program(track.inst_combo.get())
-            is_drum = prog == 35
-            for card in track.card_frame.winfo_children():
-                if not isinstance(card, RiffCard): continue
-                riff = card.riff
-                if not riff['notes']: continue
-                dur = get_duration(riff['duration'])
-                for ng in riff['notes']:
-                    if ng.upper()=='R':
-                        ax.text(x,6,'rest',fontsize=12,ha='center')
-                        x += dur*0.8; continue
-                    if is_drum:
-                        for s in ng.split('+'):
-                            sym = 'X' if s[0].upper()=='S' else 'o'
-                            ax.text(x,6,sym,fontsize=14,ha='center',va='center')
-                        x += dur*0.8; continue
-                    subs = ng.split('+')
-                    ys = [staff_pos(s[0].upper(), c_scale) for s in subs]
-                    for i, s in enumerate(subs):
-                        acc = accidental_sym(s)
-                        if acc: ax.text(x-0.3, ys[i], acc, fontsize=12, ha='center')
-                        ax.add_patch(Ellipse((x,ys[i]),0.7,0.5, facecolor='k', edgecolor='k'))
-                    if dur<4 and len(subs)>1:
-                        ax.vlines(x+0.35, min(ys), max(ys)+2.5, color='k', lw=1.5)
-                    x += dur*0.8
-            x += 1.5
+        if self._export_canvas is None:
+            from matplotlib.backends.backend_pdf import FigureCanvasPdf
+            self._export_fig = Figure(figsize=(12,6))
+            self._export_ax = self._export_fig.add_subplot(111)
+            self._export_canvas = FigureCanvasPdf(self._export_fig)
+        ax = self._export_ax; ax.clear()
+        draw_staff_background(ax)
+        _, x = self._render_score(ax)
         ax.set_xlim(0, max(x+2,15)); ax.set_ylim(0,12); ax.axis('off')
-        fig.savefig(path, bbox_inches='tight')
-        plt.close(fig)
+        self._export_canvas.print_figure(path, format='pdf', bbox_inches='tight')
         messagebox.showinfo("Saved", f"PDF → {path}")
 
     def new_song(self):
         if messagebox.askyesno("New","Discard?"):
             self.song_data = [[{'notes':[], 'duration':'4s', 'c_scale':60, 'strum':False} for _ in range(3)] for _ in range(4)]
-            for track in self.tracks:
-                for card in track.card_frame.winfo_children():
-                    if isinstance(card, RiffCard):
+            with self._batch_redraw():
+                for track in self.tracks:
+                    for card in track.cards:
                         card.riff.update(self.song_data[track.idx][card.idx])
                         card.entry.delete(0,tk.END)
                         card.history.clear()
                         card.redo_stack.clear()
                         card.draw_staff(empty=True)
-            self.update_full_sheet()
 
     def open_song(self):
         path = filedialog.askopenfilename(filetypes=[("JSON","*.json")])
@@ -536,28 +669,30 @@ class CardWriterApp:
         with open(path) as f: data = json.load(f)
         self.song_data = data['tracks']
         self.global_bpm.delete(0,tk.END); self.global_bpm.insert(0,str(data.get('bpm',120)))
-        for t, track in enumerate(self.tracks):
-            prog = self.song_data[t][0].get('instrument', extract_program(track.inst_combo.get()))
-            opts = track.inst_combo['values']
-            match = next((o for o in opts if f"({prog})" in o), opts[0])
-            track.inst_combo.set(match)
-            c_val = next((c for c in track.c_combo['values'] if f"({self.song_data[t][0]['c_scale']})" in c), "C4 (60)")
-            track.c_combo.set(c_val)
-            for i, card in enumerate(track.card_frame.winfo_children()):
-                if isinstance(card, RiffCard):
+        with self._batch_redraw():
+            for t, track in enumerate(self.tracks):
+                prog = self.song_data[t][0].get('instrument', track._prog)
+                opts = track.inst_combo['values']
+                match = next((o for o in opts if f"({prog})" in o), opts[0])
+                track.inst_combo.set(match)
+                c_val = next((c for c in track.c_combo['values'] if f"({self.song_data[t][0]['c_scale']})" in c), "C4 (60)")
+                track.c_combo.set(c_val)
+                track._refresh_prog(); track._refresh_c_scale()
+                for i, card in enumerate(track.cards):
                     card.riff.update(self.song_data[t][i])
+                    riff_parsed(card.riff)
                     card.entry.delete(0,tk.END)
                     card.entry.insert(0,' '.join(self.song_data[t][i]['notes']))
                     card.strum_var.set(self.song_data[t][i].get('strum',False))
                     card.history.clear()
                     card.redo_stack.clear()
                     card.draw_staff()
-        self.update_full_sheet()
 
     def save_song(self):
         path = filedialog.asksaveasfilename(defaultextension=".json")
         if not path: return
-        payload = {'bpm': int(self.global_bpm.get() or 120), 'tracks': self.song_data}
+        tracks = [[{k:v for k,v in riff.items() if not k.startswith('_')} for riff in row] for row in self.song_data]
+        payload = {'bpm': int(self.global_bpm.get() or 120), 'tracks': tracks}
         with open(path,'w') as f: json.dump(payload, f, indent=2)
         messagebox.showinfo("Saved", f"Song → {path}")
 
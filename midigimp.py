@@ -1,16 +1,36 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
 from midiutil import MIDIFile
-import pygame
 import threading
+import hashlib
+import pickle
+from concurrent.futures import ThreadPoolExecutor
 import tempfile
+import io
 import os
+import re
+import struct
 import time
-import matplotlib.pyplot as plt
-from matplotlib.patches import Ellipse
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+from array import array
+from collections import namedtuple, OrderedDict
+from functools import lru_cache
+from types import SimpleNamespace
+
+NOTE_MAP = {'C': 0, 'D': 2, 'E': 4, 'F': 5, 'G': 7, 'A': 9, 'B': 11}
+POS_MAP = {'C': 0, 'D': 1, 'E': 2, 'F': 3, 'G': 4, 'A': 5, 'B': 6}
+DURATIONS = {'1s': 4, '2': 2, '4s': 1, '8s': 0.5, '16s': 0.25, '32s': 0.125}
+
+# NOTE_MAP/POS_MAP as arrays indexed by ord(letter) - 65 (A=0 .. G=6) for the hot paths
+_SEMI = array('b', [NOTE_MAP[c] for c in 'ABCDEFG'])   # [9, 11, 0, 2, 4, 5, 7]
+_STAFF = array('b', [POS_MAP[c] for c in 'ABCDEFG'])   # [5, 6, 0, 1, 2, 3, 4]
+
+# A note group is a rest or one or more '+'-joined notes, each a letter with an optional #/b/% modifier
+NOTE_RE = re.compile(r'^(?:[Rr]|[A-Ga-g][#bB%]?(?:\+[A-Ga-g][#bB%]?)*)$')
+
+# The helpers below are pure and music is repetitive, so they are memoized
 
 # Note to MIDI number mapping
+@lru_cache(maxsize=512)
 def get_midi_note(note_str, octave):
     note_str_upper = note_str.upper()
     if note_str_upper == 'R':
@@ -25,23 +45,22 @@ def get_midi_note(note_str, octave):
     if modifier and modifier not in ('#', 'b', '%'):
         raise ValueError(f"Invalid modifier: {modifier}")
     
-    note_map = {'C': 0, 'D': 2, 'E': 4, 'F': 5, 'G': 7, 'A': 9, 'B': 11}
-    base = note_map[letter]
+    base = _SEMI[ord(letter) - 65]
     
     if modifier == '#':
         base += 1
-    elif modifier in ('b', '%'):
+    elif modifier:
         base -= 1
     
-    base = base % 12
-    return (octave + 1) * 12 + base
+    return (octave + 1) * 12 + (base % 12)
 
 # Staff position for diatonic note
+@lru_cache(maxsize=512)
 def get_staff_position(letter, octave):
-    pos_map = {'C': 0, 'D': 1, 'E': 2, 'F': 3, 'G': 4, 'A': 5, 'B': 6}
-    return pos_map[letter] + (octave - 4) * 7
+    return _STAFF[ord(letter) - 65] + (octave - 4) * 7
 
 # Get accidental symbol
+@lru_cache(maxsize=512)
 def get_accidental(note_str):
     if len(note_str) > 1:
         mod = note_str[1].lower()
@@ -52,22 +71,120 @@ def get_accidental(note_str):
     return ''
 
 # Duration mapping
+@lru_cache(maxsize=512)
 def get_duration(value):
-    durations = {'1s': 4, '2': 2, '4s': 1, '8s': 0.5, '16s': 0.25, '32s': 0.125}
-    return durations.get(value, 1)
+    return DURATIONS.get(value, 1)
+
+# Staff position indexed by the MIDI number of the natural (unaltered) note; only white keys are filled
+STAFF_POS = [0] * 128
+for _octave in range(-1, 10):
+    for _letter, _semi in NOTE_MAP.items():
+        if 0 <= (_octave + 1) * 12 + _semi < 128:
+            STAFF_POS[(_octave + 1) * 12 + _semi] = get_staff_position(_letter, _octave)
+
+# Durations in integer 32nd-note ticks (a quarter is 8), so bar positions are tracked without float drift
+TICKS = {k: int(v * 8) for k, v in DURATIONS.items()}
+TICKS_PER_BAR = 32  # 4/4
+
+# Note head facecolor and whether a stem is drawn, per duration in beats
+FILL_LUT = {d: ('black' if d <= 1 else 'white', d < 4) for d in DURATIONS.values()}
+
+# Songs with at least this many riffs skip midiutil and use the hand-written encoder below
+FAST_MIDI_MIN_RIFFS = 32
+
+def _vlq(n):
+    """Encode n as a MIDI variable-length quantity."""
+    out = bytearray([n & 0x7F])
+    n >>= 7
+    while n:
+        out.insert(0, (n & 0x7F) | 0x80)
+        n >>= 7
+    return out
+
+def _write_midi_fast(events, tempo, ppq=480):
+    """Encode compiled events as a format-0, single-track MIDI file on channel 0."""
+    # (tick, order, data): at equal ticks note-offs sort first, then tempo/program changes, then note-ons
+    timeline = [(0, 1, b'\xff\x51\x03' + struct.pack('>I', 60000000 // tempo)[1:])]
+    for when, program in zip(events['program_times'], events['programs']):
+        timeline.append((round(when * ppq), 1, bytes((0xC0, program))))
+    # A chord can repeat a pitch (C+c, C#+Db); write it once, as midiutil's removeDuplicates does
+    seen = set()
+    for pitch, start, dur in zip(events['pitches'], events['starts'], events['durs']):
+        on = round(start * ppq)
+        if (pitch, on) in seen:
+            continue
+        seen.add((pitch, on))
+        timeline.append((on, 2, bytes((0x90, pitch, 100))))
+        timeline.append((on + round(dur * ppq), 0, bytes((0x80, pitch, 0))))
+    timeline.sort(key=lambda evt: (evt[0], evt[1]))
+    
+    track = bytearray()
+    last_tick = 0
+    for tick, _, data in timeline:
+        track += _vlq(tick - last_tick)
+        track += data
+        last_tick = tick
+    track += b'\x00\xff\x2f\x00'  # end of track
+    
+    header = b'MThd' + struct.pack('>IHHH', 6, 0, 1, ppq)
+    return header + b'MTrk' + struct.pack('>I', len(track)) + bytes(track)
+
+# Number of serialized songs kept by the MIDI byte cache
+MIDI_CACHE_SIZE = 8
+
+# Resolution of the pre-rendered staff background (clef/time-signature head and staff-line strip)
+STAFF_BG_DPI = 200
+
+# One riff's sheet layout, with x measured from the riff's own start
+RiffDrawables = namedtuple('RiffDrawables', 'heads facecolor rests accidentals stems ledgers bars width end_phase')
+
+# The whole song's sheet layout in data coordinates, shared by every preview window and PDF export
+SheetLayout = namedtuple('SheetLayout', 'rests accidentals offsets facecolors stem_segs ledger_segs bars x_max')
+
+class ReusableMIDIFile(MIDIFile):
+    """MIDIFile that can be cleared and refilled instead of reallocated for every build."""
+    
+    def reset(self):
+        for track in self.tracks:
+            track.eventList = []
+            track.MIDIEventList = []
+            track.MIDIdata = b""
+            track.dataLength = 0
+            track.closed = False
+        self.closed = False
+        self.event_counter = 0
 
 class MidiWriterApp:
     def __init__(self, root):
         self.root = root
         self.root.title("Custom MIDI Writer")
+        self.root.protocol("WM_DELETE_WINDOW", self._on_close)
         
         self.riffs = []
         self.editing_index = None
         self.preview_thread = None
+        self._preview_future = None
+        # MIDI builds run one at a time off the UI thread; previews, exports and prebuilds all queue here
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._stop_flag = False
+        # One stable per-process file for backends that need a real path, overwritten when the MIDI changes
+        self._preview_file_path = os.path.join(tempfile.gettempdir(), f'grokriff_preview_{os.getpid()}.mid')
+        self._preview_file_bytes = None
+        self._midi_bytes_by_hash = OrderedDict()  # content hash -> MIDI bytes, LRU of MIDI_CACHE_SIZE
+        self._midi = None
+        self._compiled = None
+        self._sheet_layout = None  # (riffs key, SheetLayout)
+        self._riff_drawables = {}
+        self._staff_bg = None
+        # pygame and matplotlib are slow to import, so they load on first use (see _get_pygame/_get_mpl)
+        self._pygame = None
+        self._mpl = None
         
         self.new_riff_button = tk.Button(root, text="New Riff", command=self.add_new_riff)
-        self.new_riff_button.pack(pady=10)
+        self.new_riff_button.grid(row=0, column=0, pady=10)
         
+        # Root widgets use grid so the input frame can be hidden and re-shown in its own row
+        root.columnconfigure(0, weight=1)
         self.input_frame = tk.Frame(root)
         
         tk.Label(self.input_frame, text="Enter notes (e.g., A# B Bb R A+B+E):").pack(side=tk.LEFT)
@@ -97,28 +214,37 @@ class MidiWriterApp:
         self.instrument_combo.current(0)
         self.instrument_combo.pack(side=tk.LEFT, padx=5)
         
+        # Option label <-> number lookups, built once from the "(n)" suffix of each label
+        self._octave_by_num = {int(re.search(r'\((\d+)\)', o).group(1)): o for o in self.octave_options}
+        self._instrument_by_num = {int(re.search(r'\((\d+)\)', o).group(1)): o for o in self.instrument_options}
+        self._num_by_octave_label = {o: n for n, o in self._octave_by_num.items()}
+        self._num_by_instrument_label = {o: n for n, o in self._instrument_by_num.items()}
+        
         self.add_button = tk.Button(self.input_frame, text="Add Riff", command=self.save_riff)
         self.add_button.pack(side=tk.LEFT, padx=5)
         
+        self.input_frame.grid(row=1, column=0, pady=10)
+        self.input_frame.grid_remove()
+        
         self.song_list = tk.Listbox(root, height=10, width=70)
-        self.song_list.pack(pady=10)
+        self.song_list.grid(row=2, column=0, pady=10)
         
         self.manage_frame = tk.Frame(root)
         self.edit_button = tk.Button(self.manage_frame, text="Edit Selected", command=self.edit_riff)
         self.edit_button.pack(side=tk.LEFT, padx=5)
         self.delete_button = tk.Button(self.manage_frame, text="Delete Selected", command=self.delete_riff)
         self.delete_button.pack(side=tk.LEFT, padx=5)
-        self.manage_frame.pack(pady=5)
+        self.manage_frame.grid(row=3, column=0, pady=5)
         
-        tk.Label(root, text="BPM:").pack()
+        tk.Label(root, text="BPM:").grid(row=4, column=0)
         self.bpm_entry = tk.Entry(root, width=10)
         self.bpm_entry.insert(0, "120")
-        self.bpm_entry.pack(pady=5)
+        self.bpm_entry.grid(row=5, column=0, pady=5)
         
-        tk.Label(root, text="MIDI File Name (e.g., my_song.mid):").pack()
+        tk.Label(root, text="MIDI File Name (e.g., my_song.mid):").grid(row=6, column=0)
         self.file_name_entry = tk.Entry(root, width=30)
         self.file_name_entry.insert(0, "song.mid")
-        self.file_name_entry.pack(pady=5)
+        self.file_name_entry.grid(row=7, column=0, pady=5)
         
         self.button_frame = tk.Frame(root)
         self.preview_button = tk.Button(self.button_frame, text="Preview MIDI", command=self.preview_riffs)
@@ -131,7 +257,7 @@ class MidiWriterApp:
         self.export_button.pack(side=tk.LEFT, padx=5)
         self.export_sheet_button = tk.Button(self.button_frame, text="Export Sheet PDF", command=self.export_sheet)
         self.export_sheet_button.pack(side=tk.LEFT, padx=5)
-        self.button_frame.pack(pady=10)
+        self.button_frame.grid(row=8, column=0, pady=10)
     
     def add_new_riff(self):
         self.editing_index = None
@@ -140,7 +266,7 @@ class MidiWriterApp:
         self.duration_combo.current(2)
         self.octave_combo.current(2)
         self.instrument_combo.current(0)
-        self.input_frame.pack(pady=10)
+        self.input_frame.grid()
         self.new_riff_button.config(state=tk.DISABLED)
     
     def save_riff(self):
@@ -156,29 +282,14 @@ class MidiWriterApp:
             return
         
         duration = self.duration_combo.get()
-        octave_str = self.octave_combo.get()
-        octave = int(octave_str.split('(')[1][0])
-        instrument_str = self.instrument_combo.get()
-        instrument = int(instrument_str.split('(')[1][:-1])
+        octave = self._num_by_octave_label[self.octave_combo.get()]
+        instrument = self._num_by_instrument_label[self.instrument_combo.get()]
         
         notes = notes_str.split()
-        for note_group in notes:
-            if note_group.upper() == 'R':
-                continue
-            sub_notes = note_group.split('+')
-            for sub in sub_notes:
-                letter = sub[0].upper()
-                if letter not in 'ABCDEFG':
-                    messagebox.showerror("Error", f"Invalid note letter: {letter} in {sub}")
-                    return
-                if len(sub) > 1:
-                    mod = sub[1].lower()
-                    if mod not in ('#', 'b', '%'):
-                        messagebox.showerror("Error", f"Invalid modifier: {mod} in {sub}")
-                        return
-                if len(sub) > 2:
-                    messagebox.showerror("Error", f"Note too long: {sub}")
-                    return
+        bad = next((g for g in notes if not NOTE_RE.match(g)), None)
+        if bad:
+            messagebox.showerror("Error", f"Invalid note: {bad}")
+            return
         
         riff = {'notes': notes, 'duration': duration, 'octave': octave, 'instrument': instrument}
         
@@ -196,8 +307,9 @@ class MidiWriterApp:
             self.editing_index = None
         
         self.notes_entry.delete(0, tk.END)
-        self.input_frame.pack_forget()
+        self.input_frame.grid_remove()
         self.new_riff_button.config(state=tk.NORMAL)
+        self._prebuild_midi()
     
     def edit_riff(self):
         try:
@@ -211,13 +323,10 @@ class MidiWriterApp:
             self.notes_entry.insert(0, ' '.join(riff['notes']))
             self.duration_combo.set(riff['duration'])
             
-            octave_opt = [opt for opt in self.octave_options if f"({riff['octave']})" in opt][0]
-            self.octave_combo.set(octave_opt)
+            self.octave_combo.set(self._octave_by_num[riff['octave']])
+            self.instrument_combo.set(self._instrument_by_num[riff['instrument']])
             
-            instrument_opt = [opt for opt in self.instrument_options if f"({riff['instrument']})" in opt][0]
-            self.instrument_combo.set(instrument_opt)
-            
-            self.input_frame.pack(pady=10)
+            self.input_frame.grid()
             self.new_riff_button.config(state=tk.DISABLED)
         except IndexError:
             messagebox.showerror("Error", "Select a riff to edit!")
@@ -227,78 +336,128 @@ class MidiWriterApp:
             index = self.song_list.curselection()[0]
             del self.riffs[index]
             self.song_list.delete(index)
+            self._prebuild_midi()
         except IndexError:
             messagebox.showerror("Error", "Select a riff to delete!")
     
+    def _prebuild_midi(self):
+        # Speculatively build the edited song so the next preview or export finds it cached
+        if not self.riffs:
+            return
+        try:
+            tempo = int(self.bpm_entry.get())
+        except ValueError:
+            return
+        self._executor.submit(self._build_midi_bytes, tempo, list(self.riffs))
+    
     def preview_riffs(self):
         if not self.riffs:
             messagebox.showerror("Error", "No riffs to preview!")
             return
         
-        if self.preview_thread and self.preview_thread.is_alive():
+        if (self.preview_thread and self.preview_thread.is_alive()) or \
+                (self._preview_future and not self._preview_future.done()):
             messagebox.showinfo("Info", "Preview already playing!")
             return
         
-        self.preview_thread = threading.Thread(target=self._play_preview)
+        try:
+            tempo = int(self.bpm_entry.get())
+        except ValueError:
+            messagebox.showerror("Error", "Invalid BPM!")
+            return
+        
+        # Reset here on the UI thread, so a Stop pressed while the MIDI is still building is honoured
+        self._stop_flag = False
+        
+        # Build on the executor and start playback as soon as the bytes are ready
+        self._preview_future = self._executor.submit(self._build_midi_bytes, tempo, list(self.riffs))
+        self._preview_future.add_done_callback(self._start_playback)
+    
+    def _start_playback(self, future):
+        # Runs on the executor thread; playback gets its own thread so the executor stays free for builds.
+        # Dialogs are handed to the Tk main loop with root.after instead of being shown from here
+        try:
+            midi_bytes = future.result()
+        except Exception as e:
+            self.root.after(0, messagebox.showerror, "Error", f"Preview failed: {str(e)}")
+            return
+        if self._stop_flag:
+            return
+        self.preview_thread = threading.Thread(target=self._play_preview, args=(midi_bytes,))
         self.preview_thread.start()
     
-    def _play_preview(self):
+    def _play_preview(self, midi_bytes):
         try:
-            tempo = int(self.bpm_entry.get())
-            
-            with tempfile.NamedTemporaryFile(suffix='.mid', delete=False) as temp_file:
-                midi = MIDIFile(1)
-                track = 0
-                channel = 0
-                time_pos = 0
-                volume = 100
-                
-                midi.addTempo(track, time_pos, tempo)
-                
-                current_instrument = None
-                for riff in self.riffs:
-                    if riff['instrument'] != current_instrument:
-                        midi.addProgramChange(track, channel, time_pos, riff['instrument'])
-                        current_instrument = riff['instrument']
-                    
-                    dur = get_duration(riff['duration'])
-                    for note_group in riff['notes']:
-                        if note_group.upper() == 'R':
-                            time_pos += dur
-                            continue
-                        sub_notes = note_group.split('+')
-                        pitches = [get_midi_note(sub, riff['octave']) for sub in sub_notes]
-                        for pitch in pitches:
-                            midi.addNote(track, channel, pitch, time_pos, dur, volume)
-                        time_pos += dur
-                
-                midi.writeFile(temp_file)
-                temp_file_path = temp_file.name
-            
-            total_beats = sum(get_duration(r['duration']) * len(r['notes']) for r in self.riffs)
-            total_seconds = total_beats * (60 / tempo) + 2
-            
-            pygame.init()
-            pygame.mixer.init()
-            pygame.mixer.music.load(temp_file_path)
+            pygame = self._get_pygame()
+            midi_buf = io.BytesIO(midi_bytes)
+            try:
+                pygame.mixer.music.load(midi_buf, 'mid')
+            except pygame.error:
+                # Some SDL_mixer builds only load MIDI from a path
+                pygame.mixer.music.load(self._write_preview_file(midi_bytes))
             pygame.mixer.music.play()
             
-            time.sleep(total_seconds)
+            # Poll instead of sleeping for the whole song so Stop takes effect right away
+            while pygame.mixer.music.get_busy() and not self._stop_flag:
+                time.sleep(0.05)
             
             pygame.mixer.music.stop()
-            pygame.quit()
-            
-            os.remove(temp_file_path)
+            pygame.mixer.music.unload()
             
-            messagebox.showinfo("Success", "Preview finished!")
+            if not self._stop_flag:
+                messagebox.showinfo("Success", "Preview finished!")
         except Exception as e:
             messagebox.showerror("Error", f"Preview failed: {str(e)}")
         finally:
             self.preview_thread = None
     
+    def _write_preview_file(self, midi_bytes):
+        # File fallback, overwritten in place only when the MIDI content changes
+        if self._preview_file_bytes != midi_bytes:
+            with open(self._preview_file_path, 'wb') as f:
+                f.write(midi_bytes)
+            self._preview_file_bytes = midi_bytes
+        return self._preview_file_path
+    
+    def _get_pygame(self):
+        # Import pygame on first preview and initialise the mixer once with a small buffer
+        if self._pygame is None:
+            import pygame
+            self._pygame = pygame
+        pygame = self._pygame
+        if not pygame.mixer.get_init():
+            pygame.mixer.pre_init(frequency=44100, buffer=1024)
+            pygame.mixer.init()
+        return pygame
+    
+    def _get_mpl(self):
+        # Import the matplotlib pieces used by the sheet view on first use
+        if self._mpl is None:
+            import numpy as np
+            from matplotlib.figure import Figure
+            from matplotlib.collections import EllipseCollection, LineCollection
+            from matplotlib.backends.backend_agg import FigureCanvasAgg
+            from matplotlib.backends.backend_pdf import FigureCanvasPdf
+            from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+            self._mpl = SimpleNamespace(np=np, Figure=Figure, EllipseCollection=EllipseCollection,
+                                        LineCollection=LineCollection, FigureCanvasAgg=FigureCanvasAgg,
+                                        FigureCanvasPdf=FigureCanvasPdf, FigureCanvasTkAgg=FigureCanvasTkAgg)
+        return self._mpl
+    
+    def _on_close(self):
+        self.stop_preview()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        if self._preview_file_bytes is not None:
+            try:
+                os.remove(self._preview_file_path)
+            except OSError:
+                pass
+        self.root.destroy()
+    
     def stop_preview(self):
-        if pygame.get_init():
-            pygame.mixer.music.stop()
+        self._stop_flag = True
+        if self._pygame is not None and self._pygame.mixer.get_init():
+            self._pygame.mixer.music.stop()
     
     def export_midi(self):
         if not self.riffs:
@@ -317,18 +476,38 @@ class MidiWriterApp:
             messagebox.showerror("Error", "Invalid BPM!")
             return
         
-        midi = MIDIFile(1)
-        track = 0
-        channel = 0
-        time_pos = 0
-        volume = 100
-        
-        midi.addTempo(track, time_pos, tempo)
+        # Build on the executor without blocking the UI; the file is written back on the Tk main loop
+        future = self._executor.submit(self._build_midi_bytes, tempo, list(self.riffs))
+        future.add_done_callback(lambda f: self.root.after(0, self._finish_export, f, file_name))
+    
+    def _finish_export(self, future, file_name):
+        try:
+            midi_bytes = future.result()
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to build MIDI: {str(e)}")
+            return
         
+        try:
+            with open(file_name, "wb") as output_file:
+                output_file.write(midi_bytes)
+            messagebox.showinfo("Success", f"MIDI file '{file_name}' created successfully!")
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to save MIDI: {str(e)}")
+    
+    def _compile_events(self, riffs, riffs_key):
+        """Flatten riffs into parallel note/program arrays, cached until the riffs change."""
+        compiled = self._compiled
+        if compiled is not None and compiled[0] == riffs_key:
+            return compiled[1]
+        
+        pitches, starts, durs = array('h'), array('f'), array('f')
+        program_times, programs = array('f'), array('B')
+        time_pos = 0
         current_instrument = None
-        for riff in self.riffs:
+        for riff in riffs:
             if riff['instrument'] != current_instrument:
-                midi.addProgramChange(track, channel, time_pos, riff['instrument'])
+                program_times.append(time_pos)
+                programs.append(riff['instrument'])
                 current_instrument = riff['instrument']
             
             dur = get_duration(riff['duration'])
@@ -336,30 +515,69 @@ class MidiWriterApp:
                 if note_group.upper() == 'R':
                     time_pos += dur
                     continue
-                sub_notes = note_group.split('+')
-                pitches = [get_midi_note(sub, riff['octave']) for sub in sub_notes]
-                for pitch in pitches:
-                    midi.addNote(track, channel, pitch, time_pos, dur, volume)
+                for sub in note_group.split('+'):
+                    pitches.append(get_midi_note(sub, riff['octave']))
+                    starts.append(time_pos)
+                    durs.append(dur)
                 time_pos += dur
         
-        try:
-            with open(file_name, "wb") as output_file:
-                midi.writeFile(output_file)
-            messagebox.showinfo("Success", f"MIDI file '{file_name}' created successfully!")
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to save MIDI: {str(e)}")
+        events = {'pitches': pitches, 'starts': starts, 'durs': durs,
+                  'program_times': program_times, 'programs': programs}
+        self._compiled = (riffs_key, events)
+        return events
+    
+    def _build_midi_bytes(self, tempo, riffs):
+        # Preview and export often serialize the same song; look the bytes up by content hash first.
+        # riffs is a snapshot taken on the UI thread, since this runs on the executor
+        key = hashlib.blake2b(pickle.dumps(riffs + [tempo]), digest_size=8).digest()
+        cached = self._midi_bytes_by_hash.get(key)
+        if cached is not None:
+            self._midi_bytes_by_hash.move_to_end(key)
+            return cached
+        
+        riffs_key = self._riffs_key(riffs)
+        events = self._compile_events(riffs, riffs_key)
+        if len(riffs) >= FAST_MIDI_MIN_RIFFS:
+            midi_bytes = _write_midi_fast(events, tempo)
+        else:
+            midi_bytes = self._write_midi_midiutil(events, tempo)
+        self._midi_bytes_by_hash[key] = midi_bytes
+        if len(self._midi_bytes_by_hash) > MIDI_CACHE_SIZE:
+            self._midi_bytes_by_hash.popitem(last=False)
+        return midi_bytes
+    
+    def _write_midi_midiutil(self, events, tempo):
+        if self._midi is None:
+            self._midi = ReusableMIDIFile(1, file_format=1)
+        else:
+            self._midi.reset()
+        midi = self._midi
+        track = 0
+        channel = 0
+        volume = 100
+        
+        midi.addTempo(track, 0, tempo)
+        for when, program in zip(events['program_times'], events['programs']):
+            midi.addProgramChange(track, channel, when, program)
+        for pitch, start, dur in zip(events['pitches'], events['starts'], events['durs']):
+            midi.addNote(track, channel, pitch, start, dur, volume)
+        
+        buffer = io.BytesIO()
+        midi.writeFile(buffer)
+        return buffer.getvalue()
     
     def preview_sheet(self):
         if not self.riffs:
             messagebox.showerror("Error", "No riffs to preview!")
             return
         
-        fig, ax = self._generate_sheet_figure()
+        # Each window gets its own figure, so resizing it never affects other windows or the PDF export
+        fig, ax = self._draw_sheet_figure()
         
         sheet_win = tk.Toplevel(self.root)
         sheet_win.title("Sheet Music Preview")
         
-        canvas = FigureCanvasTkAgg(fig, master=sheet_win)
+        canvas = self._get_mpl().FigureCanvasTkAgg(fig, master=sheet_win)
         canvas.draw()
         canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
     
@@ -373,103 +591,201 @@ class MidiWriterApp:
             file_name = file_name[:-4]
         pdf_name = file_name + '.pdf'
         
-        fig, ax = self._generate_sheet_figure()
+        # A dedicated figure keeps the export at the fixed 12x4 in size
+        fig, ax = self._draw_sheet_figure()
+        self._get_mpl().FigureCanvasPdf(fig)
         try:
             fig.savefig(pdf_name)
             messagebox.showinfo("Success", f"Sheet music PDF '{pdf_name}' created successfully!")
         except Exception as e:
             messagebox.showerror("Error", f"Failed to save PDF: {str(e)}")
-        finally:
-            plt.close(fig)
     
-    def _generate_sheet_figure(self):
-        fig, ax = plt.subplots(figsize=(12, 4))
-        
-        # Draw staff lines
-        staff_ys = [2, 4, 6, 8, 10]
-        for sy in staff_ys:
-            ax.axhline(sy, color='black', linewidth=1)
-        
-        # Treble clef
-        ax.text(0, 7, '𝄞', fontsize=40, va='center')
-        
-        # Time signature 4/4
-        ax.text(1.5, 9, '4', fontsize=20, va='center')
-        ax.text(1.5, 5, '4', fontsize=20, va='center')
+    def _riffs_key(self, riffs=None):
+        if riffs is None:
+            riffs = self.riffs
+        return tuple((tuple(r['notes']), r['duration'], r['octave'], r['instrument']) for r in riffs)
+    
+    def _get_sheet_layout(self):
+        """Lay out the whole song, cached until the riffs change."""
+        key = self._riffs_key()
+        if self._sheet_layout is not None and self._sheet_layout[0] == key:
+            return self._sheet_layout[1]
         
         x_pos = 3.0
-        beat_pos = 0.0
-        scale_x = 2.0  # x units per beat
-        bar_beat = 4.0  # assuming 4/4
+        phase = 0  # ticks into the current bar
+        
+        # Per-riff layouts are cached by content and bar phase, so an edit only re-lays out the changed riff.
+        # Each is shifted into place along the song
+        rests = []
+        accidentals = []
+        offsets = []
+        facecolors = []
+        stem_segs = []
+        ledger_segs = []
+        bars = []
+        drawables_cache = {}
         
         for riff in self.riffs:
-            dur = get_duration(riff['duration'])
-            for note_group in riff['notes']:
-                if note_group.upper() == 'R':
-                    # Draw rest (approximate quarter rest symbol)
-                    ax.text(x_pos, 6, '𝄽', fontsize=20, ha='center', va='center')
-                    beat_pos += dur
-                    x_pos += dur * scale_x
-                    continue
-                
-                sub_notes = note_group.split('+')
-                ys = []
-                accidentals = []
-                for sub in sub_notes:
-                    letter = sub[0].upper()
-                    acc = get_accidental(sub)
-                    y = get_staff_position(letter, riff['octave'])
-                    ys.append(y)
-                    accidentals.append(acc)
-                
-                # Draw accidentals
-                acc_x = x_pos - 0.5
-                for i, acc in enumerate(accidentals):
-                    if acc:
-                        ax.text(acc_x, ys[i], acc, fontsize=15, ha='center', va='center')
-                
-                # Determine note head style (simple: filled for <=1 beat, open for >1)
-                fill = dur <= 1
-                edgecolor = 'black' if fill else 'black'
-                facecolor = 'black' if fill else 'white'
-                
-                # Draw note heads
-                for y in ys:
-                    ax.add_patch(Ellipse((x_pos, y), width=0.8, height=0.6, facecolor=facecolor, edgecolor=edgecolor))
-                
-                # Draw stem if not whole note
-                if dur < 4:
-                    if len(ys) > 1:
-                        # Chord stem
-                        stem_y_min = min(ys)
-                        stem_y_max = max(ys)
-                        ax.vlines(x_pos + 0.4, stem_y_min, stem_y_max + 3, color='black', linewidth=2)
-                    elif len(ys) == 1:
-                        # Single note stem
-                        ax.vlines(x_pos + 0.4, ys[0], ys[0] + 3, color='black', linewidth=2)
-                
-                # Ledger lines
-                for y in ys:
-                    if y < 2:
-                        for ly in range(int(y // 2 * 2) + 2 if y % 2 else int(y // 2 * 2), 2, 2):
-                            ax.axhline(ly, x_pos - 0.6, x_pos + 0.6, color='black', linewidth=1)
-                    if y > 10:
-                        for ly in range(12, int(y // 2 * 2) + (2 if y % 2 else 0), 2):
-                            ax.axhline(ly, x_pos - 0.6, x_pos + 0.6, color='black', linewidth=1)
-                
-                beat_pos += dur
-                x_pos += dur * scale_x
-                
-                # Draw bar line if beat_pos is multiple of bar_beat
-                if beat_pos % bar_beat == 0:
-                    ax.axvline(x_pos - 0.5, 1, 11, color='black', linewidth=0.5)
-                    x_pos += 1  # extra space after bar
+            riff_key = (tuple(riff['notes']), riff['duration'], riff['octave'], phase)
+            drawables = drawables_cache.get(riff_key) or self._riff_drawables.get(riff_key)
+            if drawables is None:
+                drawables = self._riff_to_drawables(riff, phase)
+            drawables_cache[riff_key] = drawables
+            
+            rests.extend(x_pos + x for x in drawables.rests)
+            accidentals.extend((x_pos + x, y, acc) for x, y, acc in drawables.accidentals)
+            offsets.extend((x_pos + x, y) for x, y in drawables.heads)
+            facecolors.extend([drawables.facecolor] * len(drawables.heads))
+            stem_segs.extend([(x_pos + x0, y0), (x_pos + x1, y1)] for (x0, y0), (x1, y1) in drawables.stems)
+            ledger_segs.extend([(x_pos + x0, y0), (x_pos + x1, y1)] for (x0, y0), (x1, y1) in drawables.ledgers)
+            bars.extend(x_pos + x for x in drawables.bars)
+            
+            x_pos += drawables.width
+            phase = drawables.end_phase
+        
+        # Only layouts used by the current song are kept
+        self._riff_drawables = drawables_cache
+        
+        layout = SheetLayout(rests, accidentals, offsets, facecolors, stem_segs, ledger_segs, bars, x_pos + 2)
+        self._sheet_layout = (key, layout)
+        return layout
+    
+    def _draw_sheet_figure(self):
+        """Draw the cached sheet layout on a new 12x4 in figure (no canvas attached)."""
+        mpl = self._get_mpl()
+        layout = self._get_sheet_layout()
+        fig = mpl.Figure(figsize=(12, 4))
+        ax = fig.subplots()
+        
+        # Rests (approximate quarter rest symbol) and accidentals
+        for x in layout.rests:
+            ax.text(x, 6, '𝄽', fontsize=20, ha='center', va='center')
+        for x, y, acc in layout.accidentals:
+            ax.text(x, y, acc, fontsize=15, ha='center', va='center')
+        
+        # Note heads, stems, ledger lines and bar lines go in as a few collections
+        if layout.offsets:
+            ax.add_collection(mpl.EllipseCollection(0.8, 0.6, 0, units='xy', offsets=layout.offsets,
+                                                    offset_transform=ax.transData,
+                                                    facecolors=layout.facecolors, edgecolors='black'))
+        bar_segs = [[(x, 2), (x, 10)] for x in layout.bars]  # data coordinates, spanning the staff
+        if layout.stem_segs or layout.ledger_segs or bar_segs:
+            ax.add_collection(mpl.LineCollection(layout.stem_segs + layout.ledger_segs + bar_segs, colors='black',
+                                                 linewidths=[2] * len(layout.stem_segs) + [1] * len(layout.ledger_segs)
+                                                 + [0.5] * len(bar_segs)))
+        
+        # Staff lines, clef and time signature come from the cached raster: the line strip is stretched
+        # across the song, the head is placed at x=0 and sized to keep its aspect
+        head, strip = self._get_staff_background(ax)
+        ax.imshow(strip, extent=[0, layout.x_max, 0, 12], aspect='auto', zorder=-1)
+        head_im = ax.imshow(head, extent=[0, 1, 0, 12], aspect='auto', zorder=-1)
         
         ax.set_ylim(0, 12)
-        ax.set_xlim(0, x_pos + 2)
+        ax.set_xlim(0, layout.x_max)
         ax.axis('off')
         
+        def fit_head(event=None):
+            axes_box = ax.get_position()
+            axes_width_in = axes_box.width * fig.get_figwidth()
+            head_width_in = axes_box.height * fig.get_figheight() * head.shape[1] / head.shape[0]
+            head_im.set_extent([0, head_width_in * layout.x_max / axes_width_in, 0, 12])
+        
+        fit_head()
+        fig.canvas.mpl_connect('resize_event', fit_head)  # preview windows can be resized
+        
         return fig, ax
+    
+    def _get_staff_background(self, ax):
+        """Return the (head, strip) RGBA arrays of the empty staff, rendered once at ax's height."""
+        if self._staff_bg is None:
+            mpl = self._get_mpl()
+            axes_height_in = ax.get_position().height * ax.figure.get_figheight()
+            
+            def render(width_in, draw):
+                bg_fig = mpl.Figure(figsize=(width_in, axes_height_in), dpi=STAFF_BG_DPI)
+                bg_fig.patch.set_alpha(0)
+                bg_ax = bg_fig.add_axes([0, 0, 1, 1])
+                bg_ax.set_xlim(0, width_in)  # x in inches
+                bg_ax.set_ylim(0, 12)
+                bg_ax.axis('off')
+                draw(bg_ax)
+                canvas = mpl.FigureCanvasAgg(bg_fig)
+                canvas.draw()
+                return mpl.np.asarray(canvas.buffer_rgba()).copy()
+            
+            def draw_head(bg_ax):
+                # Treble clef
+                bg_ax.text(0, 7, '𝄞', fontsize=40, va='center')
+                # Time signature 4/4
+                bg_ax.text(0.45, 9, '4', fontsize=20, va='center')
+                bg_ax.text(0.45, 5, '4', fontsize=20, va='center')
+            
+            def draw_lines(bg_ax):
+                for sy in [2, 4, 6, 8, 10]:
+                    bg_ax.axhline(sy, color='black', linewidth=1)
+            
+            head = render(0.75, draw_head)
+            strip = render(4 / STAFF_BG_DPI, draw_lines)[:, 1:2]  # a single column, stretched when drawn
+            self._staff_bg = (head, strip)
+        return self._staff_bg
+    
+    def _riff_to_drawables(self, riff, phase):
+        """Lay out one riff from x=0, starting phase ticks into a bar."""
+        scale_x = 2.0  # x units per beat
+        
+        dur = get_duration(riff['duration'])
+        facecolor, has_stem = FILL_LUT[dur]
+        octave_base = (riff['octave'] + 1) * 12
+        heads, rests, accidentals, stems, ledgers, bars = [], [], [], [], [], []
+        x_pos = 0.0
+        ticks = TICKS.get(riff['duration'], 8)
+        bar_ticks = phase
+        
+        for note_group in riff['notes']:
+            if note_group.upper() == 'R':
+                rests.append(x_pos)
+                bar_ticks += ticks
+                if bar_ticks >= TICKS_PER_BAR:
+                    bar_ticks -= TICKS_PER_BAR
+                x_pos += dur * scale_x
+                continue
+            
+            sub_notes = note_group.split('+')
+            ys = [STAFF_POS[octave_base + _SEMI[ord(sub[0].upper()) - 65]] for sub in sub_notes]
+            
+            for sub, y in zip(sub_notes, ys):
+                acc = get_accidental(sub)
+                if acc:
+                    accidentals.append((x_pos - 0.5, y, acc))
+            
+            heads.extend((x_pos, y) for y in ys)
+            
+            # Stem if not whole note (a chord shares one stem)
+            if has_stem and ys:
+                stems.append(((x_pos + 0.4, min(ys)), (x_pos + 0.4, max(ys) + 3)))
+            
+            # Ledger lines
+            for y in ys:
+                if y < 2:
+                    for ly in range(int(y // 2 * 2) + 2 if y % 2 else int(y // 2 * 2), 2, 2):
+                        ledgers.append(((x_pos - 0.6, ly), (x_pos + 0.6, ly)))
+                if y > 10:
+                    for ly in range(12, int(y // 2 * 2) + (2 if y % 2 else 0), 2):
+                        ledgers.append(((x_pos - 0.6, ly), (x_pos + 0.6, ly)))
+            
+            x_pos += dur * scale_x
+            
+            # Running position in the bar; no note is longer than a bar, so one wrap is enough
+            bar_ticks += ticks
+            if bar_ticks >= TICKS_PER_BAR:
+                bar_ticks -= TICKS_PER_BAR
+            
+            # Bar line when a note ends exactly on a bar boundary
+            if bar_ticks == 0:
+                bars.append(x_pos - 0.5)
+                x_pos += 1  # extra space after bar
+        
+        return RiffDrawables(heads, facecolor, rests, accidentals, stems, ledgers, bars, x_pos, bar_ticks)
 
 # Run the app
 if __name__ == "__main__":